@@ -0,0 +1,170 @@
+"""Numba compiled kernels for computing bootstrap estimates, used if numba is available."""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+###################################################################################################
+###################################################################################################
+
+if njit is None:
+
+    _spearman_bootstrap_numba = None
+    _spearman_resampled_ranks_numba = None
+
+else:
+
+    @njit(cache=True)
+    def _rank_numba(vals):
+        """Rank values, assigning ties the average of their ranks, as in `rankdata`.
+
+        If there are any NaN values, all ranks are NaN, as in `rankdata` with 'propagate'.
+        """
+
+        n_values = vals.shape[0]
+        order = np.argsort(vals)
+
+        # NaN values are sorted last, so only the last value needs to be checked
+        ranks = np.empty(n_values)
+        if n_values > 0 and np.isnan(vals[order[-1]]):
+            ranks[:] = np.nan
+            return ranks
+
+        start = 0
+        while start < n_values:
+            stop = start
+            while stop + 1 < n_values and vals[order[stop + 1]] == vals[order[start]]:
+                stop += 1
+            for ind in range(start, stop + 1):
+                ranks[order[ind]] = (start + stop) / 2. + 1
+            start = stop + 1
+
+        return ranks
+
+
+    @njit(parallel=True, cache=True, error_model='numpy')
+    def _spearman_bootstrap_numba(x, ys):
+        """Compute spearman correlations between each pair of matching rows of x & each of ys.
+
+        Parameters
+        ----------
+        x : 2d array
+            Resampled data to compute estimates from, with shape: [n_resamples, n_values].
+        ys : 3d array
+            Resampled data to compute estimates with x, with shape: [n_ys, n_resamples, n_values].
+
+        Returns
+        -------
+        estimates : 2d array
+            Computed estimates, with shape: [n_ys, n_resamples].
+
+        Notes
+        -----
+        Each row of x is ranked once, sharing its ranks & statistics across all of ys.
+        """
+
+        n_samples, n_values = x.shape
+        n_ys = ys.shape[0]
+
+        estimates = np.empty((n_ys, n_samples))
+        for ind in prange(n_samples):
+
+            x_ranks = _rank_numba(x[ind])
+
+            sum_x = 0.
+            sum_xx = 0.
+            for val_ind in range(n_values):
+                sum_x += x_ranks[val_ind]
+                sum_xx += x_ranks[val_ind] * x_ranks[val_ind]
+            var_x = sum_xx - sum_x * sum_x / n_values
+
+            for y_ind in range(n_ys):
+
+                y_ranks = _rank_numba(ys[y_ind, ind])
+
+                sum_y = 0.
+                sum_yy = 0.
+                sum_xy = 0.
+                for val_ind in range(n_values):
+                    sum_y += y_ranks[val_ind]
+                    sum_yy += y_ranks[val_ind] * y_ranks[val_ind]
+                    sum_xy += x_ranks[val_ind] * y_ranks[val_ind]
+
+                cov_xy = sum_xy - sum_x * sum_y / n_values
+                var_y = sum_yy - sum_y * sum_y / n_values
+
+                estimates[y_ind, ind] = cov_xy / np.sqrt(var_x * var_y)
+
+        return estimates
+
+
+    @njit(cache=True)
+    def _rotl(val, shift):
+        """Rotate the bits of a 64-bit unsigned integer to the left."""
+
+        return (val << np.uint64(shift)) | (val >> np.uint64(64 - shift))
+
+
+    @njit(parallel=True, cache=True, error_model='numpy')
+    def _spearman_resampled_ranks_numba(ranks1, ranks2, seeds):
+        """Compute spearman bootstrap estimates, as pearson correlations of resampled ranks.
+
+        Parameters
+        ----------
+        ranks1, ranks2 : 1d array
+            Ranks of the data.
+        seeds : 2d array of uint64
+            Random seeds for each resample, with shape: [n_resamples, 2].
+
+        Returns
+        -------
+        estimates : 1d array
+            Computed estimates.
+
+        Notes
+        -----
+        Resample indices are generated as they are used, with a xoroshiro128** generator per
+        resample, such that no array of indices is stored.
+        """
+
+        n_samples = seeds.shape[0]
+        n_values = ranks1.shape[0]
+
+        estimates = np.empty(n_samples)
+        for ind in prange(n_samples):
+
+            state0 = seeds[ind, 0]
+            state1 = seeds[ind, 1]
+
+            sum_x = 0.
+            sum_y = 0.
+            sum_xx = 0.
+            sum_yy = 0.
+            sum_xy = 0.
+            for _ in range(n_values):
+
+                # Step the xoroshiro128** generator, and use the output to draw an index
+                output = _rotl(state0 * np.uint64(5), 7) * np.uint64(9)
+                state1 ^= state0
+                state0 = _rotl(state0, 24) ^ state1 ^ (state1 << np.uint64(16))
+                state1 = _rotl(state1, 37)
+                val_ind = output % np.uint64(n_values)
+
+                x_rank = ranks1[val_ind]
+                y_rank = ranks2[val_ind]
+                sum_x += x_rank
+                sum_y += y_rank
+                sum_xx += x_rank * x_rank
+                sum_yy += y_rank * y_rank
+                sum_xy += x_rank * y_rank
+
+            cov_xy = sum_xy - sum_x * sum_y / n_values
+            var_x = sum_xx - sum_x * sum_x / n_values
+            var_y = sum_yy - sum_y * sum_y / n_values
+
+            estimates[ind] = cov_xy / np.sqrt(var_x * var_y)
+
+        return estimates
@@ -1,13 +1,30 @@
 """Bootstrapping correlations, to calculate confidence intervals & differences measures."""
 
+from functools import partial
+from contextlib import contextmanager
+from multiprocessing import get_context, get_all_start_methods
+
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.stats import spearmanr
+from scipy.stats import spearmanr, pearsonr, rankdata
+
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+from ._numba import _spearman_bootstrap_numba, _spearman_resampled_ranks_numba
 
 ###################################################################################################
 ###################################################################################################
 
-def bootstrap_corr(vec1, vec2, n_samples=5000, alpha=0.05, func=spearmanr, return_estimates=False):
+# Default random number generator, used if one is not provided
+_rng = np.random.default_rng()
+
+
+def bootstrap_corr(vec1, vec2, n_samples=5000, alpha=0.05, func=spearmanr,
+                   return_estimates=False, rng=None, workers=1, batch=None, device='cpu',
+                   streaming=False, approx=False):
     """Calculate a correlation, with bootstrapped confidence intervals.
 
     Parameters
@@ -23,6 +40,29 @@ def bootstrap_corr(vec1, vec2, n_samples=5000, alpha=0.05, func=spearmanr, retur
         Function to use to compute correlations.
     return_estimates : bool, optional, default: False
         Whether to return to distribution of bootstrapped estimates.
+    rng : np.random.Generator, optional
+        Random number generator to use for resampling.
+        If not provided, a module level default generator is used.
+        If `approx`, resamples from a given generator differ depending on whether numba
+        is available, such that estimates are only reproducible within the same setup.
+    workers : int or map-like callable, optional, default: 1
+        Number of workers to use to compute estimates across resamples.
+        If -1, all available cores are used. Not used if `func` is spearmanr or pearsonr.
+    batch : int, optional
+        Number of resamples to compute at a time, which bounds memory usage.
+        If not provided, set such that each batch holds up to 10^7 resampled values.
+    device : {'cpu', 'gpu'}, optional, default: 'cpu'
+        Device to compute bootstrap resamples on.
+        Using 'gpu' requires cupy, and is only supported if `func` is spearmanr and `approx`.
+    streaming : bool, optional, default: False
+        Whether to compute confidence intervals from streaming quantile estimates, which are
+        updated across resamples without storing all bootstrap estimates, but which is slower.
+        Not used if `return_estimates` is True.
+    approx : bool, optional, default: False
+        Whether to compute an approximate spearman bootstrap, which is faster.
+        Only used if `func` is spearmanr. If numba is available, resample indices are
+        generated within the numba kernel, from seeds drawn from `rng`, and so differ from
+        the resamples drawn without numba, or on the gpu.
 
     Returns
     -------
@@ -36,19 +76,86 @@ def bootstrap_corr(vec1, vec2, n_samples=5000, alpha=0.05, func=spearmanr, retur
     estimates : 1d array
         The distribution of bootstrap estimates.
         Only returned if `return_estimates` is True.
+
+    Notes
+    -----
+    If `approx` is True, the data are ranked once, and bootstrap estimates are computed as
+    pearson correlations of resampled ranks. This ignores that duplicated values within a
+    resample would be re-ranked as ties, which can shift estimates, notably for small data.
+
+    If `streaming` is True, confidence intervals are estimated with the P-square algorithm,
+    which uses constant memory across any number of resamples, but is approximate. The
+    estimates are updated in python, per bootstrap estimate, which takes on the order of
+    10 microseconds per resample, such as ~100 seconds for 10^7 resamples. This is only
+    worthwhile if the estimates do not fit in memory, which holds 8 bytes per resample.
     """
 
+    if device not in ('cpu', 'gpu'):
+        raise ValueError("Device not understood, should be one of 'cpu' or 'gpu'.")
+
+    if device == 'gpu':
+        if cp is None:
+            raise ImportError("Computing bootstraps on the gpu requires cupy.")
+        if func is not spearmanr or not approx:
+            raise ValueError("Computing bootstraps on the gpu is only supported for "
+                             "the approximate spearman bootstrap.")
+
     # Calculate measured correlation of the data
     r_val, p_val = func(vec1, vec2)
 
-    # Resample bootstraps
-    bootstrap_x, bootstrap_y = sample_bootstrap(n_samples, vec1, vec2)
-
-    # Compute estimates across resamples
-    estimates = compute_bootstrap_estimates(bootstrap_x, bootstrap_y, func)
+    # For approximate spearman, rank the data once, to resample ranks rather than re-rank
+    approx = approx and func is spearmanr
+    has_nan = approx and any(np.isnan(vec).any() for vec in (vec1, vec2))
+    if approx and not has_nan:
+        ranks1, ranks2 = _int_rankdata(vec1), _int_rankdata(vec2)
+
+    # On the gpu, transfer ranks once, such that resampling & estimates are computed on device
+    if device == 'gpu' and not has_nan:
+        ranks1, ranks2 = cp.asarray(ranks1), cp.asarray(ranks2)
+        rng = cp.random.default_rng(None if rng is None else rng.integers(2**63))
+
+    # Collect estimates, or if streaming, only update estimates of the confidence intervals
+    streaming = streaming and not return_estimates
+    if streaming:
+        lower, upper = _P2Quantile(alpha / 2.), _P2Quantile(1 - alpha / 2.)
+    else:
+        estimates = np.zeros(n_samples)
+
+    # Open any pool of workers once, to share across batches, if used to compute estimates
+    with _open_workers(workers, func) as workers:
+        # Resample bootstraps & compute estimates across resamples, in batches
+        for inds in _get_batches(n_samples, len(vec1), batch):
+            if has_nan:
+                # Integer ranks can't represent NaN, so estimates are NaN, as in spearmanr
+                batch_estimates = np.full(inds.stop - inds.start, np.nan)
+            elif approx and device == 'cpu' and _spearman_resampled_ranks_numba is not None:
+                seeds = (_rng if rng is None else rng).integers(
+                    2**64, size=(inds.stop - inds.start, 2), dtype=np.uint64)
+                batch_estimates = _spearman_resampled_ranks_numba(ranks1, ranks2, seeds)
+            elif approx:
+                boot_ranks1, boot_ranks2 = sample_bootstrap(inds.stop - inds.start,
+                                                            ranks1, ranks2, rng=rng)
+                batch_estimates = _pearson_ranks(boot_ranks1, boot_ranks2)
+                if device == 'gpu':
+                    batch_estimates = batch_estimates.get()
+            else:
+                bootstrap_x, bootstrap_y = sample_bootstrap(inds.stop - inds.start,
+                                                            vec1, vec2, rng=rng)
+                batch_estimates = compute_bootstrap_estimates(bootstrap_x, bootstrap_y,
+                                                              func, workers)
+
+            if streaming:
+                for estimate in batch_estimates:
+                    lower.update(estimate)
+                    upper.update(estimate)
+            else:
+                estimates[inds] = batch_estimates
 
     # Compute confidence intervals from bootstrapped distribution
-    cis = compute_cis(estimates, alpha)
+    if streaming:
+        cis = lower.quantile(), upper.quantile()
+    else:
+        cis = compute_cis(estimates, alpha)
 
     if return_estimates:
         return r_val, p_val, cis, estimates
@@ -57,7 +164,8 @@ def bootstrap_corr(vec1, vec2, n_samples=5000, alpha=0.05, func=spearmanr, retur
 
 
 def bootstrap_diff(vec_a, vec_b, vec_c, n_samples=5000, alpha=0.05,
-                   func=spearmanr, return_estimates=False):
+                   func=spearmanr, return_estimates=False, rng=None, workers=1, batch=None,
+                   approx=False):
     """Calculate a bootstrapped difference measure of correlations AB vs. AC.
 
     Parameters
@@ -74,6 +182,18 @@ def bootstrap_diff(vec_a, vec_b, vec_c, n_samples=5000, alpha=0.05,
         Function to use to compute correlations.
     return_estimates : bool, optional, default: False
         Whether to return to distribution of bootstrapped estimates.
+    rng : np.random.Generator, optional
+        Random number generator to use for resampling.
+        If not provided, a module level default generator is used.
+    workers : int or map-like callable, optional, default: 1
+        Number of workers to use to compute estimates across resamples.
+        If -1, all available cores are used. Not used if `func` is spearmanr or pearsonr.
+    batch : int, optional
+        Number of resamples to compute at a time, which bounds memory usage.
+        If not provided, set such that each batch holds up to 10^7 resampled values.
+    approx : bool, optional, default: False
+        Whether to compute an approximate spearman bootstrap, which is faster.
+        Only used if `func` is spearmanr.
 
     Returns
     -------
@@ -86,6 +206,11 @@ def bootstrap_diff(vec_a, vec_b, vec_c, n_samples=5000, alpha=0.05,
     diff : 1d array
         The distribution of bootstrap difference estimates.
         Only returned if `return_estimates` is True.
+
+    Notes
+    -----
+    If `approx` is True, the data are ranked once, and bootstrap estimates are computed as
+    pearson correlations of resampled ranks, as in `bootstrap_corr`.
     """
 
     # Calculate measured correlations of the data
@@ -96,12 +221,33 @@ def bootstrap_diff(vec_a, vec_b, vec_c, n_samples=5000, alpha=0.05,
     # Calculate the difference in measures correlation between AB & AC
     r_diff = r_ab - r_ac
 
-    # Resample bootstraps
-    boot_a, boot_b, boot_c = sample_bootstrap(n_samples, vec_a, vec_b, vec_c)
-
-    # Compute estimates across resamples
-    corrs_ab = compute_bootstrap_estimates(boot_a, boot_b, func)
-    corrs_ac = compute_bootstrap_estimates(boot_a, boot_c, func)
+    # For approximate spearman, rank the data once, stacking B & C ranks to resample together
+    approx = approx and func is spearmanr
+    has_nan = approx and any(np.isnan(vec).any() for vec in (vec_a, vec_b, vec_c))
+    if approx and not has_nan:
+        ranks_a = _int_rankdata(vec_a)
+        ranks_bc = np.stack([_int_rankdata(vec_b), _int_rankdata(vec_c)])
+    elif not approx:
+        vec_bc = np.stack([vec_b, vec_c])
+
+    # Open any pool of workers once, to share across batches, if used to compute estimates
+    with _open_workers(workers, func) as workers:
+        # Resample bootstraps & compute estimates across resamples, in batches
+        corrs_ab = np.zeros(n_samples)
+        corrs_ac = np.zeros(n_samples)
+        for inds in _get_batches(n_samples, len(vec_a), batch):
+            # Share resample indices across arrays
+            new_idx = sample_bootstrap_indices(inds.stop - inds.start, len(vec_a), rng=rng)
+            if has_nan:
+                # Integer ranks can't represent NaN, so estimates are NaN, as in spearmanr
+                corrs_ab[inds], corrs_ac[inds] = np.nan, np.nan
+            elif approx:
+                corrs_ab[inds], corrs_ac[inds] = \
+                    _pearson_ranks(ranks_a[new_idx], ranks_bc[:, new_idx])
+            else:
+                # Compute both correlations in one pass across resamples, sharing A between them
+                corrs_ab[inds], corrs_ac[inds] = compute_bootstrap_estimates_pairs(
+                    vec_a[new_idx], vec_bc[:, new_idx], func, workers)
 
     # Calculate differences, across bootstrap resamples
     diffs = corrs_ab - corrs_ac
@@ -118,7 +264,64 @@ def bootstrap_diff(vec_a, vec_b, vec_c, n_samples=5000, alpha=0.05,
         return r_diff, p_val, cis
 
 
-def sample_bootstrap(n_samples, *arrs):
+def bootstrap_mean(vec, n_samples=5000, alpha=0.05, return_estimates=False, rng=None,
+                   batch=None):
+    """Calculate a mean, with bootstrapped confidence intervals.
+
+    Parameters
+    ----------
+    vec : 1d array
+        Array of data to compute the bootstrapped mean of.
+    n_samples : int, optional, default: 5000
+        Number of bootstrap resamples to perform.
+    alpha : float, optional, default: 0.05
+        Alpha value, that defines the confidence interval value.
+        At default value of 0.05, computes 95% confidence intervals.
+    return_estimates : bool, optional, default: False
+        Whether to return to distribution of bootstrapped estimates.
+    rng : np.random.Generator, optional
+        Random number generator to use for resampling.
+        If not provided, a module level default generator is used.
+    batch : int, optional
+        Number of resamples to compute at a time, which bounds memory usage.
+        If not provided, set such that each batch holds up to 10^7 resampled values.
+
+    Returns
+    -------
+    mean : float
+        The calculated mean of the data.
+    cis : list of [float, float]
+        Confidence interval, estimated from the bootstrap.
+    estimates : 1d array
+        The distribution of bootstrap estimates.
+        Only returned if `return_estimates` is True.
+
+    Notes
+    -----
+    As the mean is linear in the data, resamples are represented as counts of how many times
+    each value is drawn, such that the estimates of each batch are computed with a single
+    matrix product.
+    """
+
+    # Calculate measured mean of the data
+    mean = np.mean(vec)
+
+    # Resample bootstraps, as counts per value, and compute estimates across resamples, in batches
+    estimates = np.zeros(n_samples)
+    for inds in _get_batches(n_samples, len(vec), batch):
+        weights = sample_bootstrap_weights(inds.stop - inds.start, len(vec), rng=rng)
+        estimates[inds] = compute_bootstrap_estimates_linear(vec, weights)
+
+    # Compute confidence intervals from bootstrapped distribution
+    cis = compute_cis(estimates, alpha)
+
+    if return_estimates:
+        return mean, cis, estimates
+    else:
+        return mean, cis
+
+
+def sample_bootstrap(n_samples, *arrs, rng=None):
     """Resample data for bootstrapping.
 
     Parameters
@@ -127,6 +330,9 @@ def sample_bootstrap(n_samples, *arrs):
         How many resamples to computes
     *arrs : 1d array
         Arrays to resample.
+    rng : np.random.Generator, optional
+        Random number generator to use for resampling.
+        If not provided, a module level default generator is used.
 
     Returns
     -------
@@ -138,16 +344,91 @@ def sample_bootstrap(n_samples, *arrs):
     This function samples and returns as many arrays as are passed in.
     """
 
-    sample_size = len(arrs[0])
-    new_idx = np.random.choice(np.arange(sample_size), replace=True,
-                               size=(n_samples, sample_size))
+    new_idx = sample_bootstrap_indices(n_samples, len(arrs[0]), rng=rng)
 
     bootstrap_arrs = [arr[new_idx] for arr in arrs]
 
     return bootstrap_arrs
 
 
-def compute_bootstrap_estimates(x, y, func):
+def sample_bootstrap_indices(n_samples, n_values, rng=None):
+    """Sample indices for resampling data for bootstrapping.
+
+    Parameters
+    ----------
+    n_samples : int
+        How many resamples to computes
+    n_values : int
+        Number of values in the data to resample.
+    rng : np.random.Generator, optional
+        Random number generator to use for resampling.
+        If not provided, a module level default generator is used.
+
+    Returns
+    -------
+    new_idx : 2d array
+        Indices to resample data with, with shape: [n_resamples, n_values].
+    """
+
+    rng = _rng if rng is None else rng
+
+    new_idx = rng.integers(0, n_values, size=(n_samples, n_values), dtype=np.int32)
+
+    return new_idx
+
+
+def sample_bootstrap_weights(n_samples, n_values, rng=None):
+    """Resample data for bootstrapping, as counts of how often each value is drawn.
+
+    Parameters
+    ----------
+    n_samples : int
+        How many resamples to computes
+    n_values : int
+        Number of values in the data to resample.
+    rng : np.random.Generator, optional
+        Random number generator to use for resampling.
+        If not provided, a module level default generator is used.
+
+    Returns
+    -------
+    weights : 2d array
+        Number of times each value is drawn per resample, with shape: [n_values, n_resamples].
+    """
+
+    rng = _rng if rng is None else rng
+
+    weights = rng.multinomial(n_values, np.full(n_values, 1 / n_values), size=n_samples).T
+
+    return weights
+
+
+def _get_batches(n_samples, n_values, batch=None):
+    """Get slices that split bootstrap resamples into batches.
+
+    Parameters
+    ----------
+    n_samples : int
+        Total number of resamples.
+    n_values : int
+        Number of values in each resample.
+    batch : int, optional
+        Number of resamples per batch.
+        If not provided, set such that each batch holds up to 10^7 resampled values.
+
+    Returns
+    -------
+    list of slice
+        Slices of the resamples to compute in each batch.
+    """
+
+    if batch is None:
+        batch = max(1, min(n_samples, 10**7 // n_values))
+
+    return [slice(start, min(start + batch, n_samples)) for start in range(0, n_samples, batch)]
+
+
+def compute_bootstrap_estimates(x, y, func, workers=1):
     """Compute estimates across bootstrapped resamples between x & y.
 
     Parameters
@@ -156,6 +437,9 @@ def compute_bootstrap_estimates(x, y, func):
         Resampled data to compute estimates from, with shape: [n_resamples, n_values].
     func : callable
         Function to calculate esimate between data.
+    workers : int or map-like callable, optional, default: 1
+        Number of workers to use to compute estimates across resamples.
+        If -1, all available cores are used.
 
     Returns
     -------
@@ -163,14 +447,237 @@ def compute_bootstrap_estimates(x, y, func):
         Computed estimates.
     """
 
-    n_samples = x.shape[0]
-    estimates = np.zeros(n_samples)
-    for ind in range(n_samples):
-        estimates[ind] = func(x[ind], y[ind])[0]
+    # Spearman is a pearson correlation of ranks, so can be computed across all resamples at once
+    if func is spearmanr:
+        if _spearman_bootstrap_numba is not None:
+            return _spearman_bootstrap_numba(x, y[np.newaxis])[0]
+        return _pearson_rowwise(rankdata(x, axis=1), rankdata(y, axis=1))
+
+    # Pearson can also be computed across all resamples at once
+    if func is pearsonr:
+        return _pearson_rowwise(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+    # If serial, call func directly, avoiding the overhead of the mapped helper per resample
+    if workers == 1:
+        return np.fromiter((func(x_row, y_row)[0] for x_row, y_row in zip(x, y)),
+                           dtype=float, count=x.shape[0])
+
+    with _open_workers(workers, func) as mapper:
+        estimates = np.fromiter(mapper(partial(_compute_estimate, func), zip(x, y)),
+                                dtype=float, count=x.shape[0])
+
+    return estimates
+
+
+def _compute_estimate(func, xy):
+    """Compute an estimate from a single resample, defined at module level to be picklable."""
+
+    return func(*xy)[0]
+
+
+@contextmanager
+def _open_workers(workers, func):
+    """Open a pool of workers to compute estimates across resamples, if used for func.
+
+    Parameters
+    ----------
+    workers : int or map-like callable
+        Number of workers to use to compute estimates across resamples.
+        If -1, all available cores are used.
+    func : callable
+        Function to calculate esimate between data.
+
+    Yields
+    ------
+    workers : 1 or map-like callable
+        The map of a pool of workers, or 1 if estimates are computed serially.
+
+    Notes
+    -----
+    Pools are started with 'forkserver', if available, or 'spawn', rather than the default
+    start method, which may be 'fork'. Forking after the numba kernels have run with the tbb
+    threading layer leaves the interpreter stuck at exit.
+    """
+
+    # Spearman & pearson are computed across all resamples at once, without workers
+    if workers == 1 or func in (spearmanr, pearsonr):
+        yield 1
+    elif callable(workers):
+        yield workers
+    else:
+        method = 'forkserver' if 'forkserver' in get_all_start_methods() else 'spawn'
+        with get_context(method).Pool(None if workers == -1 else workers) as pool:
+            yield pool.map
+
+
+def compute_bootstrap_estimates_pairs(x, ys, func, workers=1):
+    """Compute estimates across bootstrapped resamples between x & each of ys.
+
+    Parameters
+    ----------
+    x : 2d array
+        Resampled data to compute estimates from, with shape: [n_resamples, n_values].
+    ys : list of 2d array or 3d array
+        Resampled data to compute estimates with x, each with shape: [n_resamples, n_values].
+        If a 3d array, with shape: [n_ys, n_resamples, n_values], it is used without copying.
+    func : callable
+        Function to calculate esimate between data.
+    workers : int or map-like callable, optional, default: 1
+        Number of workers to use to compute estimates across resamples.
+        If -1, all available cores are used.
+
+    Returns
+    -------
+    estimates : 2d array
+        Computed estimates, with shape: [n_ys, n_resamples].
+
+    Notes
+    -----
+    Resamples are looped across once, computing the estimates for all of ys per resample.
+    """
+
+    # Spearman & pearson can be computed across all resamples at once, sharing statistics of x
+    if func is spearmanr:
+        if _spearman_bootstrap_numba is not None:
+            return _spearman_bootstrap_numba(x, np.asarray(ys))
+        return _pearson_rowwise(rankdata(x, axis=1), rankdata(np.asarray(ys), axis=-1))
+    if func is pearsonr:
+        return _pearson_rowwise(np.asarray(x, dtype=float), np.asarray(ys, dtype=float))
+
+    # If serial, call func directly, avoiding the overhead of the mapped helper per resample
+    if workers == 1:
+        estimates = np.array([[func(x_row, y_row)[0] for y_row in y_rows]
+                              for x_row, *y_rows in zip(x, *ys)], dtype=float)
+    else:
+        with _open_workers(workers, func) as mapper:
+            estimates = np.array(list(mapper(partial(_compute_estimates_pairs, func),
+                                                 zip(x, *ys))), dtype=float)
+
+    return estimates.reshape(-1, len(ys)).T
+
+
+def _compute_estimates_pairs(func, rows):
+    """Compute estimates between the first & each other row from a single resample."""
+
+    return [func(rows[0], y_row)[0] for y_row in rows[1:]]
+
+
+def compute_bootstrap_estimates_linear(x, weights):
+    """Compute estimates of the mean across bootstrapped resamples, from resample weights.
+
+    Parameters
+    ----------
+    x : 1d array
+        Data to compute estimates from.
+    weights : 2d array
+        Number of times each value is drawn per resample, with shape: [n_values, n_resamples].
+
+    Returns
+    -------
+    estimates : 1d array
+        Computed estimates.
+    """
+
+    # Convert data & counts to float once, for the matrix product
+    x = np.asarray(x, dtype=float)
+    estimates = x @ weights.astype(x.dtype) / len(x)
 
     return estimates
 
 
+def _pearson_rowwise(x, y):
+    """Compute pearson correlations between each pair of matching rows of x & y.
+
+    Parameters
+    ----------
+    x : 2d array
+        Data to compute correlations between, with shape: [n_resamples, n_values].
+    y : array
+        Data to compute correlations between, with shape: [..., n_resamples, n_values].
+        Any leading dimensions each compute correlations with x, sharing its statistics.
+
+    Returns
+    -------
+    corrs : array
+        Correlation values, one per row, with shape: [..., n_resamples].
+
+    Notes
+    -----
+    This function also supports cupy arrays, which numpy functions dispatch to.
+    """
+
+    x_demean = x - x.mean(1, keepdims=True)
+    y_demean = y - y.mean(-1, keepdims=True)
+
+    # Use einsum to compute row-wise dot products, without storing the elementwise products
+    cov_xy = np.einsum('ij,...ij->...i', x_demean, y_demean)
+    var_x = np.einsum('ij,ij->i', x_demean, x_demean)
+    var_y = np.einsum('...ij,...ij->...i', y_demean, y_demean)
+
+    corrs = cov_xy / np.sqrt(var_x * var_y)
+
+    return corrs
+
+
+def _pearson_ranks(x, y):
+    """Compute pearson correlations between each pair of matching rows of integer ranks x & y.
+
+    Parameters
+    ----------
+    x : 2d array of int
+        Ranks to compute correlations between, with shape: [n_resamples, n_values].
+    y : array of int
+        Ranks to compute correlations between, with shape: [..., n_resamples, n_values].
+        Any leading dimensions each compute correlations with x, sharing its statistics.
+
+    Returns
+    -------
+    corrs : array
+        Correlation values, one per row, with shape: [..., n_resamples].
+
+    Notes
+    -----
+    This is for ranks from `_int_rankdata`, which can be resampled as a small integer type.
+    Sums are accumulated as float, as sums of squared ranks can overflow int64 for large data.
+    This function also supports cupy arrays, which numpy functions dispatch to.
+    """
+
+    n_values = x.shape[1]
+    sum_x = x.sum(1, dtype=float)
+    sum_y = y.sum(-1, dtype=float)
+    sum_xx = np.einsum('ij,ij->i', x, x, dtype=float)
+    sum_yy = np.einsum('...ij,...ij->...i', y, y, dtype=float)
+    sum_xy = np.einsum('ij,...ij->...i', x, y, dtype=float)
+
+    cov_xy = sum_xy - sum_x * sum_y / n_values
+    var_x = sum_xx - sum_x * sum_x / n_values
+    var_y = sum_yy - sum_y * sum_y / n_values
+
+    corrs = cov_xy / np.sqrt(var_x * var_y)
+
+    return corrs
+
+
+def _int_rankdata(vec):
+    """Rank data as integers, as double the average ranks, such that ties stay exact.
+
+    Parameters
+    ----------
+    vec : 1d array
+        Data to rank.
+
+    Returns
+    -------
+    ranks : 1d array of int32
+        Ranks of the data, scaled by 2, which does not change correlations.
+    """
+
+    if np.isnan(vec).any():
+        raise ValueError("Data with NaN can not be ranked as integers.")
+
+    return (2 * rankdata(vec)).astype(np.int32)
+
+
 def compute_cis(estimates, alpha):
     """Compute confidence intervals from a distribution of bootstrapped estimates.
 
@@ -187,12 +694,116 @@ def compute_cis(estimates, alpha):
         Computd confidence intervals.
     """
 
-    lower = np.quantile(estimates, alpha / 2.)
-    upper = np.quantile(estimates, 1 - alpha / 2.)
+    lower, upper = np.quantile(estimates, [alpha / 2., 1 - alpha / 2.])
 
     return lower, upper
 
 
+class _P2Quantile():
+    """Streaming estimate of a quantile, using the P-square algorithm.
+
+    Parameters
+    ----------
+    prob : float
+        Probability of the quantile to estimate, between 0 and 1.
+
+    Notes
+    -----
+    This tracks five markers, of the minimum, maximum, target quantile & midpoints between,
+    which are adjusted as values are added, such that memory use is constant.
+    If any value is NaN, the estimate is NaN, as in `np.quantile`.
+    See Jain & Chlamtac, 1985, Communications of the ACM: https://doi.org/10.1145/4372.4378
+    """
+
+    def __init__(self, prob):
+
+        self.prob = prob
+        self.has_nan = False
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * prob, 1 + 4 * prob, 3 + 2 * prob, 5]
+        self.increments = [0, prob / 2, prob, (1 + prob) / 2, 1]
+
+
+    def update(self, value):
+        """Update the quantile estimate with a new value."""
+
+        heights, positions = self.heights, self.positions
+
+        # NaN values can't be placed among the markers, so only record that the estimate is NaN
+        if np.isnan(value):
+            self.has_nan = True
+            return
+
+        # Collect the first five values as the initial markers
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        # Find the cell the value falls in, extending the extreme markers if needed
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = next(ind for ind in range(4) if value < heights[ind + 1])
+
+        for ind in range(cell + 1, 5):
+            positions[ind] += 1
+        for ind in range(5):
+            self.desired[ind] += self.increments[ind]
+
+        # Adjust the middle markers towards their desired positions
+        for ind in range(1, 4):
+            offset = self.desired[ind] - positions[ind]
+            if (offset >= 1 and positions[ind + 1] - positions[ind] > 1) or \
+               (offset <= -1 and positions[ind - 1] - positions[ind] < -1):
+
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(ind, step)
+                if not heights[ind - 1] < height < heights[ind + 1]:
+                    height = self._linear(ind, step)
+
+                heights[ind] = height
+                positions[ind] += step
+
+
+    def quantile(self):
+        """Get the current estimate of the quantile."""
+
+        if self.has_nan:
+            return np.nan
+
+        if len(self.heights) < 5:
+            return np.quantile(self.heights, self.prob)
+
+        return self.heights[2]
+
+
+    def _parabolic(self, ind, step):
+        """Compute the piecewise-parabolic prediction of an adjusted marker height."""
+
+        hgt, pos = self.heights, self.positions
+
+        upper = (pos[ind] - pos[ind - 1] + step) * \
+            (hgt[ind + 1] - hgt[ind]) / (pos[ind + 1] - pos[ind])
+        lower = (pos[ind + 1] - pos[ind] - step) * \
+            (hgt[ind] - hgt[ind - 1]) / (pos[ind] - pos[ind - 1])
+
+        return hgt[ind] + step / (pos[ind + 1] - pos[ind - 1]) * (upper + lower)
+
+
+    def _linear(self, ind, step):
+        """Compute the linear prediction of an adjusted marker height."""
+
+        hgt, pos = self.heights, self.positions
+
+        return hgt[ind] + step * (hgt[ind + step] - hgt[ind]) / (pos[ind + step] - pos[ind])
+
+
 def compute_pvalue(estimates, test_val=0):
     """Compute the empirical p-value from a bootstrapped distribution.
 
@@ -215,12 +826,13 @@ def compute_pvalue(estimates, test_val=0):
     By default, this computes a two-sided comparison against null hypothesis of 0.
     """
 
+    estimates = np.asarray(estimates)
+
     # Calculate empirical p: proportion of estimates below threshold value
-    sorted_estimates = np.sort(estimates)
-    p_value = sum(sorted_estimates < test_val) / len(sorted_estimates)
+    p_value = np.count_nonzero(estimates < test_val) / estimates.size
 
     # Make two sided
-    p_value = 2 * np.min([p_value, 1-p_value])
+    p_value = 2 * min(p_value, 1 - p_value)
 
     return p_value
 
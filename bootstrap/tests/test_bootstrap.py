@@ -0,0 +1,358 @@
+"""Tests for bootstrap.bootstrap, checking estimates, resampling & confidence intervals."""
+
+import numpy as np
+import pytest
+from scipy.stats import spearmanr, pearsonr, kendalltau, rankdata
+
+import bootstrap.bootstrap as bs
+
+###################################################################################################
+###################################################################################################
+
+def _make_data(n_values, seed=0):
+
+    rng = np.random.default_rng(seed)
+    vec1 = rng.normal(size=n_values)
+    vec2 = vec1 + rng.normal(size=n_values)
+
+    return vec1, vec2
+
+
+@pytest.mark.parametrize('with_nan', [False, True])
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_compute_bootstrap_estimates_spearman(monkeypatch, use_numba, with_nan):
+
+    if use_numba and bs._spearman_bootstrap_numba is None:
+        pytest.skip('numba is not available')
+    if not use_numba:
+        monkeypatch.setattr(bs, '_spearman_bootstrap_numba', None)
+
+    vec1, vec2 = _make_data(50)
+    if with_nan:
+        vec1[3] = np.nan
+    boot1, boot2 = bs.sample_bootstrap(100, vec1, vec2, rng=np.random.default_rng(1))
+
+    estimates = bs.compute_bootstrap_estimates(boot1, boot2, spearmanr)
+    expected = [spearmanr(row1, row2)[0] for row1, row2 in zip(boot1, boot2)]
+
+    # Resamples that draw the NaN value should have NaN estimates, as in spearmanr
+    if with_nan:
+        assert np.isnan(estimates).any() and not np.isnan(estimates).all()
+    assert np.allclose(estimates, expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('dtypes', [(float, float), (int, int), (int, float)])
+def test_compute_bootstrap_estimates_pearson(dtypes):
+
+    vec1, vec2 = _make_data(50)
+    vec1, vec2 = (10 * vec1).astype(dtypes[0]), (10 * vec2).astype(dtypes[1])
+    boot1, boot2 = bs.sample_bootstrap(100, vec1, vec2, rng=np.random.default_rng(1))
+
+    estimates = bs.compute_bootstrap_estimates(boot1, boot2, pearsonr)
+    expected = [pearsonr(row1, row2)[0] for row1, row2 in zip(boot1, boot2)]
+
+    assert np.allclose(estimates, expected)
+
+
+def test_pearson_ranks():
+
+    vec1, vec2 = _make_data(50)
+    ranks1, ranks2 = bs._int_rankdata(vec1), bs._int_rankdata(vec2)
+    boot1, boot2 = bs.sample_bootstrap(100, ranks1, ranks2, rng=np.random.default_rng(1))
+
+    estimates = bs._pearson_ranks(boot1, boot2)
+    expected = [pearsonr(row1.astype(float), row2.astype(float))[0]
+                for row1, row2 in zip(boot1, boot2)]
+
+    assert np.allclose(estimates, expected)
+
+
+def test_pearson_ranks_large():
+
+    # Sums of squared ranks at this size overflow int64
+    ranks = bs._int_rankdata(np.random.default_rng(0).normal(size=2500000))
+    new_idx = bs.sample_bootstrap_indices(1, len(ranks), rng=np.random.default_rng(1))
+
+    assert np.allclose(bs._pearson_ranks(ranks[new_idx], ranks[new_idx]), 1)
+    assert np.allclose(bs._pearson_ranks(ranks[new_idx], -ranks[new_idx]), -1)
+
+
+def test_spearman_resampled_ranks_numba():
+
+    if bs._spearman_resampled_ranks_numba is None:
+        pytest.skip('numba is not available')
+
+    vec1, vec2 = _make_data(500)
+    ranks1, ranks2 = bs._int_rankdata(vec1), bs._int_rankdata(vec2)
+    seeds = np.random.default_rng(1).integers(2**64, size=(2000, 2), dtype=np.uint64)
+
+    estimates = bs._spearman_resampled_ranks_numba(ranks1, ranks2, seeds)
+
+    # Estimates use their own resample indices, so compare to the exact bootstrap distribution
+    boot1, boot2 = bs.sample_bootstrap(2000, vec1, vec2, rng=np.random.default_rng(2))
+    expected = [spearmanr(row1, row2)[0] for row1, row2 in zip(boot1, boot2)]
+
+    assert np.isclose(np.mean(estimates), np.mean(expected), atol=0.01)
+    assert np.isclose(np.std(estimates), np.std(expected), atol=0.01)
+
+
+def test_bootstrap_corr_spearman_exact():
+
+    # Data with ties, for which the approximate spearman bootstrap differs
+    rng = np.random.default_rng(0)
+    vec1 = rng.integers(0, 8, size=30).astype(float)
+    vec2 = vec1 + rng.integers(0, 5, size=30)
+
+    *_, estimates = bs.bootstrap_corr(vec1, vec2, n_samples=100, return_estimates=True,
+                                      rng=np.random.default_rng(1))
+
+    boot1, boot2 = bs.sample_bootstrap(100, vec1, vec2, rng=np.random.default_rng(1))
+    expected = [spearmanr(row1, row2)[0] for row1, row2 in zip(boot1, boot2)]
+
+    assert np.allclose(estimates, expected)
+
+
+def test_bootstrap_diff_spearman_exact():
+
+    vec_a, vec_b = _make_data(30)
+    vec_c = np.random.default_rng(2).normal(size=30)
+
+    *_, diffs = bs.bootstrap_diff(vec_a, vec_b, vec_c, n_samples=100, return_estimates=True,
+                                  rng=np.random.default_rng(1))
+
+    boot_a, boot_b, boot_c = bs.sample_bootstrap(100, vec_a, vec_b, vec_c,
+                                                 rng=np.random.default_rng(1))
+    expected = [spearmanr(row_a, row_b)[0] - spearmanr(row_a, row_c)[0]
+                for row_a, row_b, row_c in zip(boot_a, boot_b, boot_c)]
+
+    assert np.allclose(diffs, expected)
+
+
+def test_bootstrap_diff_generic():
+
+    vec_a, vec_b = _make_data(30)
+    vec_c = np.random.default_rng(2).normal(size=30)
+
+    *_, diffs = bs.bootstrap_diff(vec_a, vec_b, vec_c, n_samples=100, func=kendalltau,
+                                  return_estimates=True, rng=np.random.default_rng(1))
+
+    boot_a, boot_b, boot_c = bs.sample_bootstrap(100, vec_a, vec_b, vec_c,
+                                                 rng=np.random.default_rng(1))
+    expected = [kendalltau(row_a, row_b)[0] - kendalltau(row_a, row_c)[0]
+                for row_a, row_b, row_c in zip(boot_a, boot_b, boot_c)]
+
+    assert np.allclose(diffs, expected)
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_compute_bootstrap_estimates_pairs_spearman(monkeypatch, use_numba):
+
+    if use_numba and bs._spearman_bootstrap_numba is None:
+        pytest.skip('numba is not available')
+    if not use_numba:
+        monkeypatch.setattr(bs, '_spearman_bootstrap_numba', None)
+
+    vec_a, vec_b = _make_data(50)
+    vec_c = np.random.default_rng(2).normal(size=50)
+    boot_a, boot_b, boot_c = bs.sample_bootstrap(100, vec_a, vec_b, vec_c,
+                                                 rng=np.random.default_rng(1))
+
+    estimates = bs.compute_bootstrap_estimates_pairs(boot_a, [boot_b, boot_c], spearmanr)
+    expected = [[spearmanr(row_a, row_y)[0] for row_a, row_y in zip(boot_a, boot_y)]
+                for boot_y in [boot_b, boot_c]]
+
+    assert np.allclose(estimates, expected)
+
+
+@pytest.mark.parametrize('prob', [0.025, 0.5, 0.975])
+def test_p2_quantile(prob):
+
+    estimates = np.random.default_rng(0).normal(size=5000)
+
+    quantile = bs._P2Quantile(prob)
+    for estimate in estimates:
+        quantile.update(estimate)
+
+    assert np.isclose(quantile.quantile(), np.quantile(estimates, prob), atol=0.05)
+
+
+def test_bootstrap_corr_streaming():
+
+    vec1, vec2 = _make_data(50)
+
+    _, _, cis = bs.bootstrap_corr(vec1, vec2, n_samples=5000, streaming=True,
+                                  rng=np.random.default_rng(1))
+    _, _, expected = bs.bootstrap_corr(vec1, vec2, n_samples=5000,
+                                       rng=np.random.default_rng(1))
+
+    assert np.allclose(cis, expected, atol=0.02)
+
+
+def test_bootstrap_corr_streaming_nan():
+
+    # With few values, some resamples are constant, giving NaN estimates
+    vec1 = np.array([0., 1.] * 3)
+    vec2 = np.arange(6.)
+
+    with np.errstate(invalid='ignore'):
+        _, _, cis = bs.bootstrap_corr(vec1, vec2, n_samples=2000, streaming=True,
+                                      rng=np.random.default_rng(1))
+        _, _, expected = bs.bootstrap_corr(vec1, vec2, n_samples=2000,
+                                           rng=np.random.default_rng(1))
+
+    assert np.all(np.isnan(cis)) and np.all(np.isnan(expected))
+
+
+def test_bootstrap_corr_workers():
+
+    vec1, vec2 = _make_data(30)
+
+    *_, estimates = bs.bootstrap_corr(vec1, vec2, n_samples=100, func=kendalltau, workers=2,
+                                      batch=30, return_estimates=True,
+                                      rng=np.random.default_rng(1))
+    *_, expected = bs.bootstrap_corr(vec1, vec2, n_samples=100, func=kendalltau,
+                                     batch=30, return_estimates=True,
+                                     rng=np.random.default_rng(1))
+
+    assert np.allclose(estimates, expected)
+
+
+def test_compute_bootstrap_estimates_linear():
+
+    vec, _ = _make_data(50)
+    new_idx = bs.sample_bootstrap_indices(100, len(vec), rng=np.random.default_rng(1))
+
+    # Convert resample indices to counts per value, for the same resamples
+    weights = np.stack([np.bincount(row, minlength=len(vec)) for row in new_idx]).T
+
+    estimates = bs.compute_bootstrap_estimates_linear(vec, weights)
+
+    assert np.allclose(estimates, vec[new_idx].mean(1))
+
+
+def test_sample_bootstrap_weights():
+
+    weights = bs.sample_bootstrap_weights(100, 50, rng=np.random.default_rng(1))
+
+    assert weights.shape == (50, 100)
+    assert np.all(weights.sum(0) == 50)
+
+
+def test_get_batches():
+
+    batches = bs._get_batches(103, 50, batch=10)
+
+    assert len(batches) == 11
+    assert batches[-1] == slice(100, 103)
+    assert np.array_equal(np.concatenate([np.arange(103)[inds] for inds in batches]),
+                          np.arange(103))
+
+
+@pytest.mark.parametrize('func', [spearmanr, kendalltau])
+def test_bootstrap_corr_batches(func):
+
+    vec1, vec2 = _make_data(30)
+
+    *_, estimates = bs.bootstrap_corr(vec1, vec2, n_samples=103, func=func, batch=10,
+                                      return_estimates=True, rng=np.random.default_rng(1))
+    *_, expected = bs.bootstrap_corr(vec1, vec2, n_samples=103, func=func,
+                                     return_estimates=True, rng=np.random.default_rng(1))
+
+    assert len(estimates) == 103
+    assert np.allclose(estimates, expected)
+
+
+def test_int_rankdata_nan():
+
+    vec, _ = _make_data(50)
+    vec[3] = np.nan
+
+    with pytest.raises(ValueError):
+        bs._int_rankdata(vec)
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_bootstrap_approx_nan(monkeypatch, use_numba):
+
+    if use_numba and bs._spearman_resampled_ranks_numba is None:
+        pytest.skip('numba is not available')
+    if not use_numba:
+        monkeypatch.setattr(bs, '_spearman_resampled_ranks_numba', None)
+
+    vec1, vec2 = _make_data(40)
+    vec1[3] = np.nan
+
+    *_, cis, estimates = bs.bootstrap_corr(vec1, vec2, n_samples=100, approx=True,
+                                           return_estimates=True)
+    assert np.all(np.isnan(cis)) and np.all(np.isnan(estimates))
+
+    *_, cis, diffs = bs.bootstrap_diff(vec2, vec1, vec2, n_samples=100, approx=True,
+                                       return_estimates=True)
+    assert np.all(np.isnan(cis)) and np.all(np.isnan(diffs))
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_bootstrap_corr_approx(monkeypatch, use_numba):
+
+    if use_numba and bs._spearman_resampled_ranks_numba is None:
+        pytest.skip('numba is not available')
+    if not use_numba:
+        monkeypatch.setattr(bs, '_spearman_resampled_ranks_numba', None)
+
+    vec1, vec2 = _make_data(50)
+
+    *_, estimates = bs.bootstrap_corr(vec1, vec2, n_samples=2000, approx=True,
+                                      return_estimates=True, rng=np.random.default_rng(1))
+
+    new_idx = bs.sample_bootstrap_indices(2000, len(vec1), rng=np.random.default_rng(1))
+    ranks1, ranks2 = rankdata(vec1)[new_idx], rankdata(vec2)[new_idx]
+    expected = [pearsonr(row1, row2)[0] for row1, row2 in zip(ranks1, ranks2)]
+
+    # With numba, resample indices are generated in the kernel, so compare distributions
+    if use_numba:
+        assert np.isclose(np.mean(estimates), np.mean(expected), atol=0.01)
+        assert np.isclose(np.std(estimates), np.std(expected), atol=0.01)
+    else:
+        assert np.allclose(estimates, expected)
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_bootstrap_diff_approx(monkeypatch, use_numba):
+
+    if use_numba and bs._spearman_bootstrap_numba is None:
+        pytest.skip('numba is not available')
+    if not use_numba:
+        monkeypatch.setattr(bs, '_spearman_bootstrap_numba', None)
+        monkeypatch.setattr(bs, '_spearman_resampled_ranks_numba', None)
+
+    vec_a, vec_b = _make_data(30)
+    vec_c = np.random.default_rng(2).normal(size=30)
+
+    *_, diffs = bs.bootstrap_diff(vec_a, vec_b, vec_c, n_samples=100, approx=True,
+                                  return_estimates=True, rng=np.random.default_rng(1))
+
+    new_idx = bs.sample_bootstrap_indices(100, len(vec_a), rng=np.random.default_rng(1))
+    ranks_a, ranks_b, ranks_c = [rankdata(vec)[new_idx] for vec in (vec_a, vec_b, vec_c)]
+    expected = [pearsonr(row_a, row_b)[0] - pearsonr(row_a, row_c)[0]
+                for row_a, row_b, row_c in zip(ranks_a, ranks_b, ranks_c)]
+
+    assert np.allclose(diffs, expected)
+
+
+def test_bootstrap_corr_device_errors(monkeypatch):
+
+    vec1, vec2 = _make_data(30)
+
+    with pytest.raises(ValueError):
+        bs.bootstrap_corr(vec1, vec2, device='tpu')
+
+    monkeypatch.setattr(bs, 'cp', None)
+    with pytest.raises(ImportError):
+        bs.bootstrap_corr(vec1, vec2, device='gpu', approx=True)
+
+    # Check unsupported gpu bootstraps, with a placeholder for cupy, which is not used
+    monkeypatch.setattr(bs, 'cp', object())
+    with pytest.raises(ValueError):
+        bs.bootstrap_corr(vec1, vec2, device='gpu')
+    with pytest.raises(ValueError):
+        bs.bootstrap_corr(vec1, vec2, func=pearsonr, device='gpu', approx=True)